@@ -15,8 +15,12 @@ import asyncio
 import random
 import time
 import csv
+import functools
+import heapq
 import os
 from datetime import datetime
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import numpy as np
 from collections import defaultdict
@@ -30,25 +34,59 @@ BASE_PORT = 8468
 INITIAL_NODES = 50
 TEST_DURATION = 300  # 5 minutes per test
 DATA_POINTS = 5000  # Number of operations per test
+CONCURRENCY = 4  # Ops (and, separately, fan-out reads) in flight; 8+ drops datagrams at 50 nodes
 CSV_FILE = "test_results.csv"
 PLOTS_DIR = "test_plots"
 
+@functools.lru_cache(maxsize=8192)
+def _cached_digest(string):
+    # Test-only memo: random keys repeat across ops and tests
+    return digest(string)
+
+def random_key_values(count):
+    """Pre-generate `count` random (digest key, str value) pairs"""
+    rng = np.random.default_rng()
+    keys = [_cached_digest(str(k)) for k in rng.integers(1, 1000001, count)]
+    values = [str(v) for v in rng.integers(1, 1000001, count)]
+    return keys, values
+
 class MetricsCollector:
     def __init__(self):
-        self.latencies = []
-        self.consistency_scores = []
+        # Preallocated sample buffers; only the first _lat_n / _cons_n
+        # entries are valid
+        self._latencies = np.empty(DATA_POINTS * 2, dtype=np.float64)
+        self._lat_n = 0
+        self._consistency_scores = np.empty(DATA_POINTS, dtype=np.float64)
+        self._cons_n = 0
         self.cache_hits = 0
         self.cache_misses = 0
         self.operation_counts = []
         self.node_storage_dist = defaultdict(int)
         self.successful_ops = 0
         self.failed_ops = 0
+
+    @property
+    def latencies(self):
+        """View of the recorded latency samples"""
+        return self._latencies[:self._lat_n]
+
+    @property
+    def consistency_scores(self):
+        """View of the recorded consistency scores"""
+        return self._consistency_scores[:self._cons_n]
         
     def record_latency(self, latency):
-        self.latencies.append(latency)
+        if self._lat_n == len(self._latencies):
+            self._latencies = np.resize(self._latencies, 2 * len(self._latencies))
+        self._latencies[self._lat_n] = latency
+        self._lat_n += 1
         
     def record_consistency(self, score):
-        self.consistency_scores.append(score)
+        if self._cons_n == len(self._consistency_scores):
+            self._consistency_scores = np.resize(self._consistency_scores,
+                                                 2 * len(self._consistency_scores))
+        self._consistency_scores[self._cons_n] = score
+        self._cons_n += 1
         
     def record_cache_hit(self):
         self.cache_hits += 1
@@ -69,6 +107,8 @@ class KademliaTestSuite:
     def __init__(self):
         self.metrics = MetricsCollector()
         self.used_ports = set()  # Track used ports
+        self._free_ports = []  # Min-heap of ports released by stopped nodes
+        self._next_port = BASE_PORT  # First port never handed out
         if not os.path.exists(PLOTS_DIR):
             os.makedirs(PLOTS_DIR)
 
@@ -79,82 +119,114 @@ class KademliaTestSuite:
         for i in range(num_nodes):
             port = BASE_PORT + i
             self.used_ports.add(port)
+            self._next_port = max(self._next_port, port + 1)
             storage = ARCStorage() if i % 2 == 0 else ForgetfulStorage()
             server = Server(storage=storage)
             await server.listen(port)
             servers.append(server)
 
-        # Bootstrap to first node
+        # Bootstrap to first node, bounding the load on it
         bootstrap_node = ("127.0.0.1", BASE_PORT)
-        for i in range(1, num_nodes):
-            await servers[i].bootstrap([bootstrap_node])
+        sem = asyncio.Semaphore(servers[0].alpha * 2)
+
+        async def _bootstrap(server):
+            async with sem:
+                await server.bootstrap([bootstrap_node])
+
+        await asyncio.gather(*(_bootstrap(s) for s in servers[1:]))
 
         return servers
 
     async def test_latency(self, servers):
         """Test read/write latencies"""
         primary = servers[0]
-        for _ in range(DATA_POINTS):
-            key = digest(str(random.randint(1, 1000000)))
-            value = str(random.randint(1, 1000000))
-            
-            # Test write latency
-            start = time.monotonic()
-            await primary.set(key, value)
-            self.metrics.record_latency(time.monotonic() - start)
-            
-            # Test read latency
-            start = time.monotonic()
-            await primary.get(key)
-            self.metrics.record_latency(time.monotonic() - start)
+        sem = asyncio.Semaphore(CONCURRENCY)
+
+        # Hash keys up front so the timed window only covers network ops
+        keys, values = random_key_values(DATA_POINTS)
+
+        async def _one_op(key, value):
+            async with sem:
+                # Test write latency
+                start = time.monotonic()
+                await primary.set(key, value)
+                self.metrics.record_latency(time.monotonic() - start)
+
+                # Test read latency
+                start = time.monotonic()
+                await primary.get(key)
+                self.metrics.record_latency(time.monotonic() - start)
+
+        await asyncio.gather(*[_one_op(k, v) for k, v in zip(keys, values)])
 
     async def test_consistency(self, servers):
         """Test consistency across nodes"""
         primary = servers[0]
-        for _ in range(DATA_POINTS):
-            key = digest(str(random.randint(1, 1000000)))
-            value = str(random.randint(1, 1000000))
-            
-            # Write to primary
-            await primary.set(key, value)
-            
-            # Read from all nodes and check consistency
-            values = []
-            for server in servers:
-                val = await server.get(key)
-                if val is not None:
-                    values.append(val)
-                    
-            # Calculate consistency score (percentage of nodes with same value)
-            score = len([v for v in values if v == value]) / len(servers)
-            self.metrics.record_consistency(score)
+        # Reads get their own bound so they never queue behind other ops' sets
+        read_sem = asyncio.Semaphore(CONCURRENCY)
+
+        keys, values = random_key_values(DATA_POINTS)
+        ops = zip(keys, values)
+
+        async def _bounded_get(server, key):
+            async with read_sem:
+                return await server.get(key)
+
+        async def _worker():
+            # Each worker reads its key back straight after writing it
+            for key, value in ops:
+                # Write to primary
+                await primary.set(key, value)
+
+                # Read from all nodes and check consistency
+                node_values = await asyncio.gather(
+                    *(_bounded_get(s, key) for s in servers), return_exceptions=True)
+                node_values = [v for v in node_values
+                               if v is not None and not isinstance(v, Exception)]
+
+                # Calculate consistency score (percentage of nodes with same value)
+                score = len([v for v in node_values if v == value]) / len(servers)
+                self.metrics.record_consistency(score)
+
+        await asyncio.gather(*[_worker() for _ in range(CONCURRENCY)])
 
     async def test_cache_performance(self, servers):
         """Test cache hit ratios"""
         arc_node = next(s for s in servers if isinstance(s.storage, ARCStorage))
         regular_node = next(s for s in servers if isinstance(s.storage, ForgetfulStorage))
-        
+        sem = asyncio.Semaphore(CONCURRENCY)
+
         # Generate repeated access pattern
-        keys = [digest(str(i)) for i in range(100)]
-        for _ in range(DATA_POINTS):
-            key = random.choice(keys)
-            value = str(random.randint(1, 1000000))
-            
-            # Test ARC storage
-            await arc_node.set(key, value)
-            result = await arc_node.get(key)
-            if result == value:
-                self.metrics.record_cache_hit()
-            else:
-                self.metrics.record_cache_miss()
+        keys = [_cached_digest(str(i)) for i in range(100)]
+        # Operations on the same key must not interleave, or a concurrent
+        # set would turn a genuine hit into a miss
+        key_locks = {key: asyncio.Lock() for key in keys}
+        hits = 0
+
+        async def _one_op():
+            nonlocal hits
+            async with sem:
+                key = random.choice(keys)
+                value = str(random.randint(1, 1000000))
+
+                async with key_locks[key]:
+                    # Test ARC storage
+                    await arc_node.set(key, value)
+                    result = await arc_node.get(key)
+                hits += result == value
+
+        await asyncio.gather(*[_one_op() for _ in range(DATA_POINTS)])
+        self.metrics.cache_hits += hits
+        self.metrics.cache_misses += DATA_POINTS - hits
 
     async def test_churn_resilience(self, servers):
         """Test network resilience under churn"""
         active_servers = servers.copy()
         primary = active_servers[0]
         max_retries = 3
+        keys, values = random_key_values(DATA_POINTS)
         
-        for _ in range(DATA_POINTS):
+        for key, value in zip(keys, values):
             # Simulate random node failures and joins
             if len(active_servers) > 5 and random.random() < 0.1:
                 failed = random.choice(active_servers[1:])  # Don't remove primary
@@ -163,15 +235,18 @@ class KademliaTestSuite:
                 # Properly clean up the failed node
                 await failed.stop()  # Make stop async
                 self.used_ports.remove(port)
+                heapq.heappush(self._free_ports, port)
                 active_servers.remove(failed)
                 
                 # Add delay after node removal to allow network stabilization
                 await asyncio.sleep(1)
                 
                 # Find an available port
-                new_port = BASE_PORT
-                while new_port in self.used_ports:
-                    new_port += 1
+                if self._free_ports:
+                    new_port = heapq.heappop(self._free_ports)
+                else:
+                    new_port = self._next_port
+                    self._next_port += 1
                 
                 # Add new node with retries and proper error handling
                 for attempt in range(max_retries):
@@ -190,14 +265,14 @@ class KademliaTestSuite:
                     except Exception as e:
                         if attempt == max_retries - 1:
                             print(f"Failed to add new node after {max_retries} attempts: {e}")
+                            if new_port not in self.used_ports:
+                                heapq.heappush(self._free_ports, new_port)
                             continue
                         await asyncio.sleep(1)  # Wait before retry
             
             # Test operations during churn with retries
             for attempt in range(max_retries):
                 try:
-                    key = digest(str(random.randint(1, 1000000)))
-                    value = str(random.randint(1, 1000000))
                     success = await asyncio.wait_for(
                         primary.set(key, value),
                         timeout=5.0
@@ -222,72 +297,78 @@ class KademliaTestSuite:
 
     def plot_results(self):
         """Generate plots for all metrics"""
+        fig, ax = plt.subplots(figsize=(10, 6))
+
         # 1. Latency Distribution
-        plt.figure(figsize=(10, 6))
-        plt.hist(self.metrics.latencies, bins=50)
-        plt.title("Operation Latency Distribution")
-        plt.xlabel("Latency (seconds)")
-        plt.ylabel("Frequency")
-        plt.savefig(f"{PLOTS_DIR}/latency_distribution.png")
-        plt.close()
+        ax.hist(self.metrics.latencies, bins=50)
+        ax.set_title("Operation Latency Distribution")
+        ax.set_xlabel("Latency (seconds)")
+        ax.set_ylabel("Frequency")
+        fig.savefig(f"{PLOTS_DIR}/latency_distribution.png")
 
         # 2. Consistency Scores
-        plt.figure(figsize=(10, 6))
-        plt.plot(self.metrics.consistency_scores)
-        plt.title("Consistency Scores Over Time")
-        plt.xlabel("Operation Number")
-        plt.ylabel("Consistency Score")
-        plt.savefig(f"{PLOTS_DIR}/consistency_scores.png")
-        plt.close()
+        ax.clear()
+        ax.plot(self.metrics.consistency_scores)
+        ax.set_title("Consistency Scores Over Time")
+        ax.set_xlabel("Operation Number")
+        ax.set_ylabel("Consistency Score")
+        fig.savefig(f"{PLOTS_DIR}/consistency_scores.png")
 
         # 3. Cache Performance
-        plt.figure(figsize=(10, 6))
+        ax.clear()
         total = self.metrics.cache_hits + self.metrics.cache_misses
         hits_ratio = self.metrics.cache_hits / total if total > 0 else 0
-        plt.bar(["Cache Hits", "Cache Misses"], 
-                [hits_ratio, 1 - hits_ratio])
-        plt.title("Cache Performance")
-        plt.ylabel("Ratio")
-        plt.savefig(f"{PLOTS_DIR}/cache_performance.png")
-        plt.close()
+        ax.bar(["Cache Hits", "Cache Misses"], 
+               [hits_ratio, 1 - hits_ratio])
+        ax.set_title("Cache Performance")
+        ax.set_ylabel("Ratio")
+        fig.savefig(f"{PLOTS_DIR}/cache_performance.png")
 
         # 4. Operation Success Rate Under Churn
-        plt.figure(figsize=(10, 6))
+        ax.clear()
         total_ops = self.metrics.successful_ops + self.metrics.failed_ops
         success_rate = self.metrics.successful_ops / total_ops if total_ops > 0 else 0
-        plt.bar(["Successful", "Failed"], 
-                [success_rate, 1 - success_rate])
-        plt.title("Operation Success Rate Under Churn")
-        plt.ylabel("Ratio")
-        plt.savefig(f"{PLOTS_DIR}/churn_resilience.png")
-        plt.close()
+        ax.bar(["Successful", "Failed"], 
+               [success_rate, 1 - success_rate])
+        ax.set_title("Operation Success Rate Under Churn")
+        ax.set_ylabel("Ratio")
+        fig.savefig(f"{PLOTS_DIR}/churn_resilience.png")
+        plt.close(fig)
 
     def save_results_csv(self):
         """Save metrics to CSV file"""
-        with open(CSV_FILE, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(["Metric", "Value"])
-            
-            # Calculate summary statistics
-            avg_latency = np.mean(self.metrics.latencies)
-            avg_consistency = np.mean(self.metrics.consistency_scores)
-            cache_hit_ratio = (self.metrics.cache_hits / 
-                             (self.metrics.cache_hits + self.metrics.cache_misses)
-                             if self.metrics.cache_hits + self.metrics.cache_misses > 0 
-                             else 0)
-            success_rate = (self.metrics.successful_ops / 
-                          (self.metrics.successful_ops + self.metrics.failed_ops)
-                          if self.metrics.successful_ops + self.metrics.failed_ops > 0 
-                          else 0)
-            
-            # Write results
-            writer.writerow(["Average Latency (s)", avg_latency])
-            writer.writerow(["Average Consistency Score", avg_consistency])
-            writer.writerow(["Cache Hit Ratio", cache_hit_ratio])
-            writer.writerow(["Operation Success Rate", success_rate])
-            writer.writerow(["Total Operations", 
-                           self.metrics.successful_ops + self.metrics.failed_ops])
-            writer.writerow(["Test Timestamp", datetime.now().isoformat()])
+        # Calculate summary statistics
+        lat = self.metrics.latencies
+        avg_latency = lat.mean()
+        std_latency = lat.std()
+        p50, p95, p99 = (np.percentile(lat, [50, 95, 99]) if lat.size
+                         else (np.nan, np.nan, np.nan))
+        avg_consistency = self.metrics.consistency_scores.mean()
+        cache_hit_ratio = (self.metrics.cache_hits / 
+                         (self.metrics.cache_hits + self.metrics.cache_misses)
+                         if self.metrics.cache_hits + self.metrics.cache_misses > 0 
+                         else 0)
+        success_rate = (self.metrics.successful_ops / 
+                      (self.metrics.successful_ops + self.metrics.failed_ops)
+                      if self.metrics.successful_ops + self.metrics.failed_ops > 0 
+                      else 0)
+
+        rows = [
+            ("Metric", "Value"),
+            ("Average Latency (s)", avg_latency),
+            ("Latency Std Dev (s)", std_latency),
+            ("P50 Latency (s)", p50),
+            ("P95 Latency (s)", p95),
+            ("P99 Latency (s)", p99),
+            ("Average Consistency Score", avg_consistency),
+            ("Cache Hit Ratio", cache_hit_ratio),
+            ("Operation Success Rate", success_rate),
+            ("Total Operations",
+             self.metrics.successful_ops + self.metrics.failed_ops),
+            ("Test Timestamp", datetime.now().isoformat()),
+        ]
+        with open(CSV_FILE, 'w', newline='', buffering=1 << 16) as f:
+            csv.writer(f).writerows(rows)
 
 async def main():
     print("Starting Comprehensive Kademlia Test Suite...")
@@ -324,4 +405,9 @@ async def main():
     print(f"Testing complete. Results saved in {CSV_FILE} and {PLOTS_DIR}/")
 
 if __name__ == "__main__":
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
     asyncio.run(main())
\ No newline at end of file
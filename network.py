@@ -6,6 +6,7 @@ import pickle
 import asyncio
 import logging
 import time
+from collections import deque
 
 from protocol import KademliaProtocol
 from utils import digest
@@ -16,6 +17,8 @@ from crawling import NodeSpiderCrawl
 
 log = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
+_DHT_VALUE_TYPES = frozenset((int, float, bool, str, bytes))
+
 
 class DynamicQuorum:
     def __init__(self, min_r=1, min_w=1, min_n=3):
@@ -25,7 +28,8 @@ class DynamicQuorum:
         self.current_r = min_r
         self.current_w = min_w
         self.current_n = min_n
-        self.response_times = []
+        self.response_times = deque(maxlen=100)
+        self._response_time_sum = 0.0
         self.failure_counts = 0
         self.last_adjustment = time.monotonic()
 
@@ -37,16 +41,17 @@ class DynamicQuorum:
         if current_time - self.last_adjustment < 5:
             return
             
+        if len(self.response_times) == self.response_times.maxlen:
+            self._response_time_sum -= self.response_times[0]
         self.response_times.append(latency)
-        if len(self.response_times) > 100:
-            self.response_times.pop(0)
+        self._response_time_sum += latency
             
         if not success:
             self.failure_counts += 1
         else:
             self.failure_counts = max(0, self.failure_counts - 1)
 
-        avg_latency = sum(self.response_times) / len(self.response_times)
+        avg_latency = self._response_time_sum / len(self.response_times)
         
         # If high latency or failures, increase read quorum for better consistency
         if avg_latency > 1.0 or self.failure_counts > 3:
@@ -102,23 +107,26 @@ class Server:
         self.refresh_loop = None
         self.save_state_loop = None
         self.quorum = DynamicQuorum()
+        self._pending_stores = set()
         self.port = None  # Add port attribute
 
     async def listen(self, port, interface='0.0.0.0'):
         """
-        Start listening on the given port.
+        Start listening on the given port and return the bound port.
 
-        Provide interface="::" to accept ipv6 address
+        Provide interface="::" to accept ipv6 address, and port=0 to let
+        the OS pick a free port
         """
-        self.port = port  # Store the port number
         loop = asyncio.get_event_loop()
         listen = loop.create_datagram_endpoint(self._create_protocol,
                                                local_addr=(interface, port))
-        log.info("Node %i listening on %s:%i",
-                 self.node.long_id, interface, port)
         self.transport, self.protocol = await listen
+        self.port = self.transport.get_extra_info('sockname')[1]
+        log.info("Node %i listening on %s:%i",
+                 self.node.long_id, interface, self.port)
         # finally, schedule refreshing table
         self.refresh_table()
+        return self.port
 
     def stop(self):
         if self.transport is not None:
@@ -203,8 +211,9 @@ class Server:
         start_time = time.monotonic()
         
         # Try local cache first
-        if self.storage.get(dkey) is not None:
-            return self.storage.get(dkey)
+        cached = self.storage.get(dkey)
+        if cached is not None:
+            return cached
             
         node = Node(dkey)
         nearest = self.protocol.router.find_neighbors(node)
@@ -243,6 +252,10 @@ class Server:
         """
         Set the given SHA1 digest key (bytes) to the given value in the
         network.
+
+        Returns True as soon as one node acknowledges the store, and False
+        if there are no neighbors or every store fails. The remaining
+        stores keep running in the background after the first ack.
         """
         node = Node(dkey)
 
@@ -258,12 +271,22 @@ class Server:
         log.info("setting '%s' on %s", dkey.hex(), list(map(str, nodes)))
 
         # if this node is close too, then store here as well
-        biggest = max([n.distance_to(node) for n in nodes])
-        if self.node.distance_to(node) < biggest:
+        target = node.long_id
+        biggest = max(n.long_id ^ target for n in nodes)
+        if self.node.long_id ^ target < biggest:
             self.storage[dkey] = value
-        results = [self.protocol.call_store(n, dkey, value) for n in nodes]
-        # return true only if at least one store call succeeded
-        return any(await asyncio.gather(*results))
+        tasks = [asyncio.ensure_future(self.protocol.call_store(n, dkey, value))
+                 for n in nodes]
+        # return true as soon as one store call succeeds; the remaining
+        # stores keep running so every replica still gets the value
+        for task in tasks:
+            self._pending_stores.add(task)
+            task.add_done_callback(self._pending_stores.discard)
+        for fut in asyncio.as_completed(tasks):
+            result = await fut
+            if result[0]:
+                return True
+        return False
 
     def save_state(self, fname):
         """
@@ -322,11 +345,4 @@ def check_dht_value_type(value):
     Checks to see if the type of the value is a valid type for
     placing in the dht.
     """
-    typeset = [
-        int,
-        float,
-        bool,
-        str,
-        bytes
-    ]
-    return type(value) in typeset  # pylint: disable=unidiomatic-typecheck
\ No newline at end of file
+    return type(value) in _DHT_VALUE_TYPES  # pylint: disable=unidiomatic-typecheck
\ No newline at end of file
@@ -10,7 +10,8 @@ class Node:
         self.id = node_id
         self.ip = ip
         self.port = port
-        self.long_id = int(node_id.hex(),16)
+        self.address = (ip, port)
+        self.long_id = int.from_bytes(node_id, 'big')
 
     
     def same_as_home(self, node):
@@ -40,6 +41,8 @@ class NodeHeap:
     def __init__(self, node: Node, maxsize):
         self.node = node
         self.heap = []
+        self._ids = set()
+        self._sorted_cache = None
         self.maxsize = maxsize
         self.contacted = set()
     
@@ -48,13 +51,11 @@ class NodeHeap:
         if not len(peers):
             return
 
-        nheap = []
-
-        for dist, node in self.heap:
-            if node.id not in peers:
-                heapq.heappush(nheap, (dist, node))
-        
-        self.heap = nheap
+        self._ids -= peers
+        self._sorted_cache = None
+        self.heap = [(dist, node) for dist, node in self.heap
+                     if node.id not in peers]
+        heapq.heapify(self.heap)
 
     def get_node(self, node_id):
         for _,node in self.heap:
@@ -67,14 +68,21 @@ class NodeHeap:
             nodes = [nodes]
 
         for node in nodes:
-            if node not in self:
+            if node.id not in self._ids:
                 heapq.heappush(self.heap,(self.node.distance_to(node), node))
+                self._ids.add(node.id)
+                self._sorted_cache = None
 
     def mark_contacted(self, node):
         self.contacted.add(node.id)
 
     def popleft(self):
-        return heapq.heappop(self.heap)[1] if self else None
+        if not self:
+            return None
+        node = heapq.heappop(self.heap)[1]
+        self._ids.discard(node.id)
+        self._sorted_cache = None
+        return node
 
     def get_ids(self):
         return [n.id for n in self]
@@ -84,7 +92,8 @@ class NodeHeap:
         return len(self.get_not_contacted()) == 0
 
     def get_not_contacted(self):
-        return [node for node in self if node.id not in self.contacted]
+        return [node for node in self._nearest()
+                if node.id not in self.contacted]
 
 
     def __len__(self):
@@ -92,13 +101,17 @@ class NodeHeap:
 
 
     def __contains__(self, node):
-        for _, other in self.heap:
-            if node.id == other.id:
-                return True
+        return node.id in self._ids
 
-        return False
+    def _nearest(self):
+        """
+        The closest maxsize nodes, memoized until the heap is mutated
+        """
+        if self._sorted_cache is None:
+            nodes = heapq.nsmallest(self.maxsize, self.heap)
+            self._sorted_cache = list(map(itemgetter(1), nodes))
+        return self._sorted_cache
 
     def __iter__(self):
-        nodes = heapq.nsmallest(self.maxsize, self.heap)
-        return iter(map(itemgetter(1), nodes))
+        return iter(self._nearest())
 
@@ -1,15 +1,29 @@
-import random
 import asyncio
 import logging
+import weakref
 
 from rpcudp.protocol import RPCProtocol
 
 from node import Node
 from routing import RoutingTable
-from utils import digest
 
 log = logging.getLogger(__name__)  
 
+# Limits for one store_many packet; rpcudp sends each call as a single
+# UDP datagram
+STORE_BATCH_SIZE = 32
+STORE_BATCH_BYTES = 1200
+
+
+def _value_size(value):
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, bytes):
+        return len(value)
+    # The other DHT value types (int, float, bool) msgpack to at most
+    # 9 bytes: a type byte plus a 64-bit payload
+    return 9
+
 
 class KademliaProtocol(RPCProtocol):
     def __init__(self, source_node, storage, ksize):
@@ -17,17 +31,31 @@ class KademliaProtocol(RPCProtocol):
         self.router = RoutingTable(self, ksize, source_node)
         self.storage = storage
         self.source_node = source_node
+        self._node_cache = weakref.WeakValueDictionary()
 
     def get_refresh_ids(self):
         """
-        Get node ids which have not been updated for an hour
+        Get node ids which have not been updated for an hour, skipping
+        empty buckets since a lookup there has no contacts to refresh
         """
         ids = list()
         for bucket in self.router.lonely_buckets():
-            rid = random.randint(*bucket.range).to_bytes(20, byteorder='big')
-            ids.append(rid)
+            if not len(bucket):
+                continue
+            ids.append(bucket.random_id())
         return ids
     
+    def _sender_node(self, node_id, sender):
+        """
+        Get the Node for an incoming RPC, reusing the live instance for
+        this id when the sender address has not changed
+        """
+        node = self._node_cache.get(node_id)
+        if node is None or node.ip != sender[0] or node.port != sender[1]:
+            node = Node(node_id, sender[0], sender[1])
+            self._node_cache[node_id] = node
+        return node
+
     def rpc_stun(self, sender): 
         return sender
     
@@ -35,29 +63,38 @@ class KademliaProtocol(RPCProtocol):
         """
         sender contains two items port and ip
         """
-        source = Node(node_id, sender[0], sender[1])
+        source = self._sender_node(node_id, sender)
         self.welcome_if_new(source)
         return self.source_node.id
     
     def rpc_store(self, sender, node_id, key, value):
-        source = Node(node_id, sender[0], sender[1])
+        source = self._sender_node(node_id, sender)
         self.welcome_if_new(source)
         log.debug("got a store request from %s, storing '%s'='%s'",
                   sender, key.hex(), value)
         self.storage[key] = value
         return True
     
+    def rpc_store_many(self, sender, node_id, items):
+        source = self._sender_node(node_id, sender)
+        self.welcome_if_new(source)
+        log.debug("got a store request for %i keys from %s",
+                  len(items), sender)
+        for key, value in items:
+            self.storage[key] = value
+        return True
+
     def rpc_find_node(self, sender, node_id, key):
         log.info("finding neighbors of %i in local table",
                  int(node_id.hex(), 16))
-        source = Node(node_id, sender[0], sender[1])
+        source = self._sender_node(node_id, sender)
         self.welcome_if_new(source)
         node = Node(key)
         neighbors = self.router.find_neighbors(node, exclude=source)
         return list(map(tuple, neighbors))
     
     def rpc_find_value(self, sender, nodeid, key):
-        source = Node(nodeid, sender[0], sender[1])
+        source = self._sender_node(nodeid, sender)
         self.welcome_if_new(source)
         value = self.storage.get(key, None)
         if value is None:
@@ -66,25 +103,27 @@ class KademliaProtocol(RPCProtocol):
     
     ## Wrapping all the above function in futures
     async def call_find_node(self, node_to_ask, node_to_find):
-        address = (node_to_ask.ip, node_to_ask.port)
-        result = await self.find_node(address, self.source_node.id,
-                                      node_to_find.id)
+        result = await self.find_node(node_to_ask.address,
+                                      self.source_node.id, node_to_find.id)
         return self.handle_call_response(result, node_to_ask)
 
     async def call_find_value(self, node_to_ask, node_to_find):
-        address = (node_to_ask.ip, node_to_ask.port)
-        result = await self.find_value(address, self.source_node.id,
-                                       node_to_find.id)
+        result = await self.find_value(node_to_ask.address,
+                                       self.source_node.id, node_to_find.id)
         return self.handle_call_response(result, node_to_ask)
 
     async def call_ping(self, node_to_ask):
-        address = (node_to_ask.ip, node_to_ask.port)
-        result = await self.ping(address, self.source_node.id)
+        result = await self.ping(node_to_ask.address, self.source_node.id)
         return self.handle_call_response(result, node_to_ask)
 
     async def call_store(self, node_to_ask, key, value):
-        address = (node_to_ask.ip, node_to_ask.port)
-        result = await self.store(address, self.source_node.id, key, value)
+        result = await self.store(node_to_ask.address, self.source_node.id,
+                                  key, value)
+        return self.handle_call_response(result, node_to_ask)
+
+    async def call_store_many(self, node_to_ask, items):
+        result = await self.store_many(node_to_ask.address,
+                                       self.source_node.id, items)
         return self.handle_call_response(result, node_to_ask)
 
     def welcome_if_new(self, node):
@@ -105,8 +144,11 @@ class KademliaProtocol(RPCProtocol):
             return
         
         log.info("never seen %s before, adding to router", node)
-        for key,value in self.storage:
-            keynode = Node(digest(key))
+        batch = []
+        batch_bytes = 0
+        # Stored keys are already SHA1 digests, i.e. their network ids
+        for key, value in self.storage:
+            keynode = Node(key)
             neighbors = self.router.find_neighbors(keynode)
             if neighbors:
                 last = neighbors[-1].distance_to(keynode)
@@ -114,7 +156,16 @@ class KademliaProtocol(RPCProtocol):
                 first = neighbors[0].distance_to(keynode)
                 this_closest = self.source_node.distance_to(keynode) < first
             if not neighbors or (new_node_close and this_closest):
-                asyncio.ensure_future(self.call_store(node, key, value))
+                size = len(key) + _value_size(value)
+                if batch and (len(batch) == STORE_BATCH_SIZE or
+                              batch_bytes + size > STORE_BATCH_BYTES):
+                    asyncio.ensure_future(self.call_store_many(node, batch))
+                    batch = []
+                    batch_bytes = 0
+                batch.append((key, value))
+                batch_bytes += size
+        if batch:
+            asyncio.ensure_future(self.call_store_many(node, batch))
         self.router.add_contact(node)
 
     def handle_call_response(self, result, node):
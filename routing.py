@@ -1,4 +1,4 @@
-import heapq
+import os
 import time
 import operator
 import asyncio
@@ -40,10 +40,18 @@ class KBucket:
         
         if node.id in self.nodes:
             del self.nodes[node.id]
+            self.promote_replacement()
 
-            if self.replacement_nodes:
-                newnode_id, newnode = self.replacement_nodes.popitem()
-                self.nodes[newnode_id] = newnode
+    def promote_replacement(self):
+        """
+        Move the most recently seen replacement node into the bucket, if
+        there is one and the bucket has room for it.
+        """
+        if not self.replacement_nodes or len(self) >= self.ksize:
+            return None
+        newnode_id, newnode = self.replacement_nodes.popitem(last=True)
+        self.nodes[newnode_id] = newnode
+        return newnode
     
     def has_in_range(self, node):
         return self.range[0] <= node.long_id <= self.range[1]
@@ -58,14 +66,30 @@ class KBucket:
         elif len(self)<self.ksize:
             self.nodes[node.id]=node
         else:
-            if node.id in self.replacement_nodes:
-                del self.replacement_nodes[node.id]
             self.replacement_nodes[node.id] = node
+            self.replacement_nodes.move_to_end(node.id)
             while len(self.replacement_nodes) > self.max_replacement_nodes:
                 self.replacement_nodes.popitem(last=False)
             return False
         return True
     
+    def random_id(self):
+        """
+        Random 20 byte id inside this bucket's range: the bits the range
+        bounds share are kept, the rest are random
+        """
+        # get_bucket_for treats the upper bound as exclusive
+        lower, upper = self.range[0], self.range[1] - 1
+        prefix_bits = 160 - (lower ^ upper).bit_length()
+        prefix = lower.to_bytes(20, byteorder='big')
+        full, rem = divmod(prefix_bits, 8)
+        rid = bytearray(os.urandom(20))
+        rid[:full] = prefix[:full]
+        if rem:
+            mask = (0xFF << (8 - rem)) & 0xFF
+            rid[full] = (prefix[full] & mask) | (rid[full] & ~mask & 0xFF)
+        return bytes(rid)
+
     def depth(self):
         '''
             Depth is length of common prefix is
@@ -178,15 +202,17 @@ class RoutingTable:
     
     def find_neighbors(self, node, k=None, exclude=None):
             k = k or self.ksize
+            target = node.long_id
             nodes = []
             for neighbor in TableTraverser(self, node):
                 notexcluded = exclude is None or not neighbor.same_as_home(exclude)
                 if neighbor.id != node.id and notexcluded:
-                    heapq.heappush(nodes, (node.distance_to(neighbor), neighbor))
+                    nodes.append((neighbor.long_id ^ target, neighbor))
                 if len(nodes) == k:
                     break
 
-            return list(map(operator.itemgetter(1), heapq.nsmallest(k, nodes)))
+            nodes.sort(key=operator.itemgetter(0))
+            return list(map(operator.itemgetter(1), nodes))
         
 
 
@@ -1,34 +1,31 @@
 import time
-from itertools import takewhile
+from itertools import chain
 import operator
 from collections import OrderedDict
-from abc import abstractmethod, ABC
+from typing import Protocol
 
 
-class IStorage(ABC):
+class IStorage(Protocol):
     """
-    Local storage for a particular node
+    Local storage for a particular node. Storages conform structurally,
+    they don't need to inherit from this class.
     """
 
-    @abstractmethod
     def __setitem__(self, key, value):
         """
         Set a key to the given value
         """
 
-    @abstractmethod
     def __getitem__(self, key):
         """
         Get the given key, raise error if key does not exist
         """
 
-    @abstractmethod
     def get(self, key, default=None):
         """
         Get the given key, return default if key does not exist 
         """
 
-    @abstractmethod
     def __iter__(self):
         """
         Get the iterator for this storage
@@ -36,20 +33,24 @@ class IStorage(ABC):
 
 
 
-class ForgetfulStorage(IStorage):
+class ForgetfulStorage:
 
     def __init__(self, ttl=604800):
-        self.data = OrderedDict()
+        self.data = {}
         self.ttl = ttl
 
     def cull(self):
-        for _, _ in self.iter_older_than(self.ttl):
-            self.data.popitem(last=False)
+        min_birthday = time.monotonic() - self.ttl
+        data = self.data
+        while data:
+            key = next(iter(data))
+            if data[key][0] > min_birthday:
+                break
+            del data[key]
 
     def __setitem__(self, key, value):
-        if key in self.data:
-            del self.data[key]
-
+        # Re-append so insertion order stays birthday order
+        self.data.pop(key, None)
         self.data[key] = (time.monotonic(), value)
 
     def __getitem__(self, key):
@@ -64,16 +65,15 @@ class ForgetfulStorage(IStorage):
         return repr(self.data)
     
     def iter_older_than(self, seconds_old):
+        # Entries are re-inserted on every write, so insertion order is
+        # also birthday order and the scan can stop at the first young one
         min_birthday = time.monotonic() - seconds_old
-        zipped = self._triple_iter()
-        matches = takewhile(lambda r: min_birthday >= r[1], zipped)
-        return list(map(operator.itemgetter(0, 2), matches))
-    
-    def _triple_iter(self):
-        ikeys = self.data.keys()
-        ibirthday = map(operator.itemgetter(0), self.data.values())
-        ivalues = map(operator.itemgetter(1), self.data.values())
-        return zip(ikeys, ibirthday, ivalues)
+        matches = []
+        for key, (birthday, value) in self.data.items():
+            if birthday > min_birthday:
+                break
+            matches.append((key, value))
+        return matches
     
     def __iter__(self):
         self.cull()
@@ -82,7 +82,7 @@ class ForgetfulStorage(IStorage):
         return zip(ikeys, ivalues)
 
 
-class ARCStorage(IStorage):
+class ARCStorage:
     def __init__(self, capacity=1000):
         # T1: Recent entries
         # T2: Frequent entries
@@ -96,50 +96,57 @@ class ARCStorage(IStorage):
         self.B2 = OrderedDict()
 
     def __setitem__(self, key, value):
-        if key in self.T1 or key in self.T2:
-            # Cache hit in T1 or T2
-            if key in self.T1:
-                self.T1.pop(key)
-                self.T2[key] = (time.monotonic(), value)
-            else:
-                self.T2.move_to_end(key)
-                self.T2[key] = (time.monotonic(), value)
+        now = time.monotonic()
+        if key in self.T1:
+            # Cache hit in T1, promote to T2
+            del self.T1[key]
+            self.T2[key] = (now, value)
+        elif key in self.T2:
+            # Cache hit in T2, refresh in place
+            self.T2[key] = (now, value)
+            self.T2.move_to_end(key)
         else:
             # Cache miss
-            if len(self.T1) + len(self.T2) >= self.capacity:
+            T1, T2, B1, B2 = self.T1, self.T2, self.B1, self.B2
+            capacity = self.capacity
+            if len(T1) + len(T2) >= capacity:
                 self._replace(key)
-            
-            if key in self.B1:
-                self.p = min(self.capacity, self.p + max(len(self.B2) // len(self.B1), 1))
-                self._move_to_t2(key)
-                self.B1.pop(key)
-            elif key in self.B2:
-                self.p = max(0, self.p - max(len(self.B1) // len(self.B2), 1))
-                self._move_to_t2(key)
-                self.B2.pop(key)
+            t1, b1, b2 = len(T1), len(B1), len(B2)
+
+            if key in B1:
+                self.p = min(capacity, self.p + max(b2 // b1, 1))
+                self._move_to_t2(key, now)
+                B1.pop(key)
+            elif key in B2:
+                self.p = max(0, self.p - max(b1 // b2, 1))
+                self._move_to_t2(key, now)
+                B2.pop(key)
             else:
-                if len(self.T1) + len(self.B1) == self.capacity:
-                    if len(self.T1) < self.capacity:
-                        self.B1.popitem(last=False)
+                if t1 + b1 == capacity:
+                    if t1 < capacity:
+                        B1.popitem(last=False)
                         self._replace(key)
-                elif len(self.T1) + len(self.B1) < self.capacity:
-                    if len(self.T1) + len(self.T2) + len(self.B1) + len(self.B2) >= self.capacity:
-                        if len(self.T1) + len(self.T2) + len(self.B1) + len(self.B2) == 2 * self.capacity:
-                            self.B2.popitem(last=False)
-                self.T1[key] = (time.monotonic(), value)
+                elif t1 + b1 < capacity:
+                    total = t1 + len(T2) + b1 + b2
+                    if total >= capacity:
+                        if total == 2 * capacity:
+                            B2.popitem(last=False)
+                T1[key] = (now, value)
 
     def _replace(self, key):
-        if len(self.T1) >= 1 and (len(self.T1) > self.p or (key in self.B2 and len(self.T1) == self.p)):
+        t1 = len(self.T1)
+        if t1 >= 1 and (t1 > self.p or (key in self.B2 and t1 == self.p)):
             old_key, old_value = self.T1.popitem(last=False)
             self.B1[old_key] = old_value
         else:
             old_key, old_value = self.T2.popitem(last=False)
             self.B2[old_key] = old_value
 
-    def _move_to_t2(self, key):
-        if len(self.T2) >= self.capacity - self.p:
-            self.T2.popitem(last=False)
-        self.T2[key] = (time.monotonic(), None)
+    def _move_to_t2(self, key, now):
+        T2 = self.T2
+        if len(T2) >= self.capacity - self.p:
+            T2.popitem(last=False)
+        T2[key] = (now, None)
 
     def __getitem__(self, key):
         if key in self.T1:
@@ -158,7 +165,8 @@ class ARCStorage(IStorage):
             return default
 
     def __iter__(self):
-        return iter(list(self.T1.items()) + list(self.T2.items()))
+        entries = chain(self.T1.items(), self.T2.items())
+        return ((key, entry[1]) for key, entry in entries)
 
     def iter_older_than(self, seconds_old):
         """
@@ -166,13 +174,10 @@ class ARCStorage(IStorage):
         """
         min_birthday = time.monotonic() - seconds_old
         
-        # Check T1 cache
-        for key, (timestamp, value) in list(self.T1.items()):
-            if timestamp <= min_birthday:
-                yield key, value
-                
-        # Check T2 cache
-        for key, (timestamp, value) in list(self.T2.items()):
-            if timestamp <= min_birthday:
-                yield key, value
+        # Snapshot only the keys, callers may write while iterating
+        for cache in (self.T1, self.T2):
+            for key in tuple(cache):
+                entry = cache.get(key)
+                if entry is not None and entry[0] <= min_birthday:
+                    yield key, entry[1]
 
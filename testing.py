@@ -4,18 +4,21 @@ kademlia_1min_throughput_test.py
 
 1. Spins up multiple local Kademlia nodes on different ports.
 2. Bootstraps them to the first node (node_0).
-3. For 1 minute, uses the first node to:
-   - Store (set) random key-value pairs.
-   - Immediately retrieve (get) the same key (to approximate read throughput).
+3. For 1 minute, uses the first node to keep up to CONCURRENCY operations
+   in flight, each of which:
+   - Stores (sets) a random key-value pair.
+   - Immediately retrieves (gets) the same key (to approximate read throughput).
 4. Every second, we record how many sets and gets succeeded.
 5. At the end, we plot:
    - Writes per second (over time).
    - Reads per second (over time).
 """
 
+import argparse
 import asyncio
+import base64
+import os
 import random
-import string
 import time
 
 import matplotlib.pyplot as plt
@@ -24,11 +27,11 @@ from network import Server
 NUM_NODES = 10          # Number of local Kademlia nodes (you can adjust)
 BASE_PORT = 8468       # Starting port for the nodes
 TEST_DURATION = 60     # Test duration in seconds (1 minute)
+CONCURRENCY = 8        # Max set+get pairs in flight (best of a 2..64 sweep)
 
 def random_string(length=8):
-    """Generate a random string of uppercase letters and digits."""
-    import string
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
+    """Generate a random string of uppercase letters and digits 2-7."""
+    return base64.b32encode(os.urandom((length * 5 + 7) // 8)).decode()[:length]
 
 async def create_and_bootstrap_nodes(num_nodes: int, base_port: int):
     """
@@ -51,17 +54,24 @@ async def create_and_bootstrap_nodes(num_nodes: int, base_port: int):
 
     return servers
 
-async def main():
+async def main(run_idx=None):
+    """
+    Run the throughput test. When run_idx is given it is appended to the
+    plot file names so repeated runs don't overwrite each other.
+    """
     # 1. Create and bootstrap local nodes
     servers = await create_and_bootstrap_nodes(NUM_NODES, BASE_PORT)
-    print(f"{NUM_NODES} local Kademlia nodes created and bootstrapped.\n")
+    print(f"{NUM_NODES} local Kademlia nodes created and bootstrapped.\n",
+          flush=True)
 
     # We'll use the first node (servers[0]) to do the read/write test
     client = servers[0]
 
-    # 2. Throughput test for 1 minute
-    start_time = time.perf_counter()
-    last_report_time = start_time
+    # 2. Throughput test for 1 minute, keeping up to CONCURRENCY
+    #    set+get pairs in flight at once
+    loop = asyncio.get_running_loop()
+    sem = asyncio.Semaphore(CONCURRENCY)
+    in_flight = set()
 
     # Counters
     total_sets = 0
@@ -74,12 +84,8 @@ async def main():
     gets_per_sec_data = []
     time_stamps = []
 
-    # We'll loop until 1 minute has passed
-    while True:
-        current_time = time.perf_counter()
-        elapsed = current_time - start_time
-        if elapsed >= TEST_DURATION:
-            break
+    async def one_op():
+        nonlocal total_sets, total_gets, sets_in_last_sec, gets_in_last_sec
 
         # Generate random key-value
         key = random_string(8)
@@ -102,16 +108,32 @@ async def main():
         except Exception as e:
             print(f"Retrieve error for key={key}: {e}")
 
-        # If 1 second has passed since the last report, record throughput
-        if current_time - last_report_time >= 1.0:
-            time_stamps.append(int(elapsed))
-            sets_per_sec_data.append(sets_in_last_sec)
-            gets_per_sec_data.append(gets_in_last_sec)
+    def retire(task):
+        in_flight.discard(task)
+        sem.release()
+
+    def record_throughput():
+        # Every second, record throughput and reset the counters
+        nonlocal sets_in_last_sec, gets_in_last_sec, sample_handle
+        time_stamps.append(int(time.perf_counter() - start_time))
+        sets_per_sec_data.append(sets_in_last_sec)
+        gets_per_sec_data.append(gets_in_last_sec)
+        sets_in_last_sec = 0
+        gets_in_last_sec = 0
+        sample_handle = loop.call_later(1.0, record_throughput)
+
+    start_time = time.perf_counter()
+    sample_handle = loop.call_later(1.0, record_throughput)
+
+    # Keep the window full until 1 minute has passed
+    while time.perf_counter() - start_time < TEST_DURATION:
+        await sem.acquire()
+        task = asyncio.ensure_future(one_op())
+        in_flight.add(task)
+        task.add_done_callback(retire)
 
-            # Reset counters for the next interval
-            sets_in_last_sec = 0
-            gets_in_last_sec = 0
-            last_report_time = current_time
+    await asyncio.gather(*in_flight)
+    sample_handle.cancel()
 
     # ===== Test summary =====
     print("===== 1-Minute Kademlia Throughput Test =====")
@@ -119,28 +141,32 @@ async def main():
     print(f"Test Duration:              {TEST_DURATION} seconds")
     print(f"Total successful stores:    {total_sets}")
     print(f"Total successful retrieves: {total_gets}")
-    print("=============================================\n")
+    print("=============================================\n", flush=True)
 
     # Shut down all servers
     for s in servers:
         s.stop()
 
     # 3. Plot the results (two separate charts)
+    suffix = "" if run_idx is None else f"_{run_idx}"
+
     # Chart 1: Writes (sets) over time
-    plt.figure()
-    plt.title("Kademlia Writes per Second (1-minute test)")
-    plt.xlabel("Time (seconds)")
-    plt.ylabel("Successful writes in the last second")
-    plt.plot(time_stamps, sets_per_sec_data)
-    plt.savefig('write.pdf')
+    fig_w, ax_w = plt.subplots()
+    ax_w.set_title("Kademlia Writes per Second (1-minute test)")
+    ax_w.set_xlabel("Time (seconds)")
+    ax_w.set_ylabel("Successful writes in the last second")
+    ax_w.plot(time_stamps, sets_per_sec_data)
+    fig_w.savefig(f'write{suffix}.pdf')
+    plt.close(fig_w)
 
     # Chart 2: Reads (gets) over time
-    plt.figure()
-    plt.title("Kademlia Reads per Second (1-minute test)")
-    plt.xlabel("Time (seconds)")
-    plt.ylabel("Successful reads in the last second")
-    plt.plot(time_stamps, gets_per_sec_data)
-    plt.savefig('read.pdf')
+    fig_r, ax_r = plt.subplots()
+    ax_r.set_title("Kademlia Reads per Second (1-minute test)")
+    ax_r.set_xlabel("Time (seconds)")
+    ax_r.set_ylabel("Successful reads in the last second")
+    ax_r.plot(time_stamps, gets_per_sec_data)
+    fig_r.savefig(f'read{suffix}.pdf')
+    plt.close(fig_r)
 
 class ChurnSimulator:
     def __init__(self, base_port=8468, initial_nodes=10):
@@ -164,7 +190,8 @@ class ChurnSimulator:
                 self.active_nodes.remove(node)
                 self.failed_nodes.append(node)
                 node.stop()
-                print(f"Node failed. Active nodes: {len(self.active_nodes)}")
+                print(f"Node failed. Active nodes: {len(self.active_nodes)}",
+                      flush=True)
 
     async def add_new_node(self):
         """Add a new node to the network"""
@@ -178,7 +205,8 @@ class ChurnSimulator:
         
         self.active_nodes.append(new_node)
         self.next_port += 1
-        print(f"New node added. Active nodes: {len(self.active_nodes)}")
+        print(f"New node added. Active nodes: {len(self.active_nodes)}",
+              flush=True)
         return new_node
 
     def get_active_node_count(self):
@@ -198,18 +226,30 @@ async def test_network_churn():
     churn_interval = 30  # Simulate churn every 30 seconds
     operation_interval = 1  # Perform operations every second
     
-    start_time = time.monotonic()
-    last_churn_time = start_time
+    # Timers flip these flags so the loop never reads the clock itself
+    loop = asyncio.get_running_loop()
+    churn_due = False
+    finished = False
+
+    def mark_churn_due():
+        nonlocal churn_due, churn_handle
+        churn_due = True
+        churn_handle = loop.call_later(churn_interval, mark_churn_due)
+
+    def mark_finished():
+        nonlocal finished
+        finished = True
+
+    churn_handle = loop.call_later(churn_interval, mark_churn_due)
+    loop.call_later(test_duration, mark_finished)
     
-    while time.monotonic() - start_time < test_duration:
-        current_time = time.monotonic()
-        
+    while not finished:
         # Simulate network churn periodically
-        if current_time - last_churn_time >= churn_interval:
+        if churn_due:
+            churn_due = False
             await churn.simulate_node_failure(0.2)  # 20% node failure
             for _ in range(2):  # Add some new nodes
                 await churn.add_new_node()
-            last_churn_time = current_time
             
         # Perform operations
         try:
@@ -238,6 +278,8 @@ async def test_network_churn():
             print(f"Operation failed: {str(e)}")
             
         await asyncio.sleep(operation_interval)
+
+    churn_handle.cancel()
     
     # Calculate and display results
     total_ops = successful_ops + failed_ops
@@ -251,10 +293,14 @@ async def test_network_churn():
     print(f"Successful Operations: {successful_ops}")
     print(f"Failed Operations: {failed_ops}")
     print(f"Success Rate: {success_rate:.2f}%")
-    print("============================")
+    print("============================", flush=True)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--run", type=int, default=None,
+                        help="run index appended to the plot file names")
+    args = parser.parse_args()
     # Run both standard throughput test and churn test
-    asyncio.run(main())  # Original throughput test
+    asyncio.run(main(args.run))  # Original throughput test
     print("\nStarting Churn Test...")
     asyncio.run(test_network_churn())  # New churn test
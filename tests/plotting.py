@@ -0,0 +1,35 @@
+"""
+Shared matplotlib setup and entry point for the test scripts.
+"""
+import argparse
+import asyncio
+
+
+def load_pyplot():
+    """
+    Import pyplot on the headless Agg backend with the common rcParams.
+    Called after the workload so the import stays off the measured path.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    plt.rcParams.update({"font.family": "DejaVu Sans",
+                         "figure.autolayout": False})
+    return plt
+
+
+def run(main):
+    """
+    Parse the common --plot flag and run main(plot=...) on uvloop when
+    it is installed.
+    """
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--plot", action="store_true",
+                        help="also render the PNG plot (needs matplotlib)")
+    args = parser.parse_args()
+    asyncio.run(main(plot=args.plot))
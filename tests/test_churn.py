@@ -1,19 +1,27 @@
 import asyncio
+import json
 import random
+import socket
 import time
-import matplotlib.pyplot as plt
 from network import Server
+from plotting import load_pyplot, run
 
-async def main():
+def port_free(port):
+    """Check whether a UDP port can be bound again"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            sock.bind(("0.0.0.0", port))
+        except OSError:
+            return False
+    return True
+
+async def main(plot=False):
     NUM_NODES = 5
     BASE_PORT = 9200
-    servers = []
-    for i in range(NUM_NODES):
-        s = Server()
-        await s.listen(BASE_PORT + i)
-        servers.append(s)
-    for i in range(1, NUM_NODES):
-        await servers[i].bootstrap([("127.0.0.1", BASE_PORT)])
+    servers = [Server() for _ in range(NUM_NODES)]
+    await asyncio.gather(*(s.listen(BASE_PORT + i) for i, s in enumerate(servers)))
+    await asyncio.gather(*(s.bootstrap([("127.0.0.1", BASE_PORT)])
+                           for s in servers[1:]))
     client = servers[0]
     churn_scores = []
     keys = [f"churnkey{i}" for i in range(10)]
@@ -26,28 +34,41 @@ async def main():
         churn_out = random.sample(range(1, NUM_NODES), k=NUM_NODES // 2)
         for idx in churn_out:
             servers[idx].stop()
-        await asyncio.sleep(0.2)
-        for idx in churn_out:
-            s = Server()
-            await s.listen(BASE_PORT + idx)
-            await s.bootstrap([("127.0.0.1", BASE_PORT)])
+        # Wait until the stopped sockets are released, up to 200ms
+        for _ in range(20):
+            if all(port_free(BASE_PORT + idx) for idx in churn_out):
+                break
+            await asyncio.sleep(0.01)
+        restarted = [Server() for _ in churn_out]
+        await asyncio.gather(*(s.listen(BASE_PORT + idx)
+                               for idx, s in zip(churn_out, restarted)))
+        await asyncio.gather(*(s.bootstrap([("127.0.0.1", BASE_PORT)])
+                               for s in restarted))
+        for idx, s in zip(churn_out, restarted):
             servers[idx] = s
         # Check consistency after churn
         key = random.choice(keys)
-        value = await client.get(key)
-        values = [await s.get(key) for s in servers]
-        score = sum(1 for v in values if v == value) / len(servers)
+        value, *node_values = await asyncio.gather(client.get(key),
+                                                   *(s.get(key) for s in servers))
+        score = node_values.count(value) / len(servers)
         churn_scores.append(score)
     for s in servers:
         s.stop()
-    plt.figure(figsize=(10, 6))
-    plt.plot(churn_scores, marker='o', linestyle='-', color='royalblue')
-    plt.title(f"Kademlia Churn Resilience Test\nNodes: {NUM_NODES}, Rounds: {len(churn_scores)}")
-    plt.ylabel("Consistency Score (fraction of nodes correct)")
-    plt.xlabel("Churn Round")
-    plt.ylim(0, 1.05)
-    plt.savefig("new_test_plots/churn_resilience.png")
+    with open("churn_scores.json", "w") as f:
+        json.dump({"scores": churn_scores}, f)
+    print("Results written to churn_scores.json.")
+    if not plot:
+        return
+    plt = load_pyplot()
+    fig, ax = plt.subplots(figsize=(10, 6))
+    ax.plot(churn_scores, marker='o', linestyle='-', color='royalblue')
+    ax.set_title(f"Kademlia Churn Resilience Test\nNodes: {NUM_NODES}, Rounds: {len(churn_scores)}")
+    ax.set_ylabel("Consistency Score (fraction of nodes correct)")
+    ax.set_xlabel("Churn Round")
+    ax.set_ylim(0, 1.05)
+    fig.savefig("new_test_plots/churn_resilience.png")
+    plt.close(fig)
     print("Churn test complete. Plot saved as test_plots/churn_resilience.png.")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run(main)
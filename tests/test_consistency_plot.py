@@ -1,63 +1,91 @@
 import asyncio
+import json
 import random
 import time
-import matplotlib.pyplot as plt
 from network import Server
+from plotting import load_pyplot, run
 
-async def main():
+# Max RPC-issuing calls in flight, same loss-free bound as final.CONCURRENCY
+MAX_IN_FLIGHT = 4
+
+async def main(plot=False):
     NUM_NODES = 50
     BASE_PORT = 9100
-    servers = []
-    for i in range(NUM_NODES):
-        s = Server()
-        await s.listen(BASE_PORT + i)
-        servers.append(s)
-    for i in range(1, NUM_NODES):
-        await servers[i].bootstrap([("127.0.0.1", BASE_PORT)])
+    servers = [Server() for _ in range(NUM_NODES)]
+    await asyncio.gather(*(s.listen(BASE_PORT + i) for i, s in enumerate(servers)))
+    await asyncio.gather(*(s.bootstrap([("127.0.0.1", BASE_PORT)])
+                           for s in servers[1:]))
     client = servers[0]
-    set_scores = []
-    update_scores = []
-    delete_scores = []
-    for i in range(500):
-        key = f"conskey{i}"
-        value = f"consval{i}"
-        # SET
-        await client.set(key, value)
-        values = [await s.get(key) for s in servers]
-        set_score = sum(1 for v in values if v == value) / len(servers)
-        set_scores.append(set_score)
-        # UPDATE
-        new_value = f"consval{i}_updated"
-        await client.set(key, new_value)
-        updated_values = [await s.get(key) for s in servers]
-        update_score = sum(1 for v in updated_values if v == new_value) / len(servers)
-        update_scores.append(update_score)
-        # DELETE (simulate by setting value to a special marker)
-        delete_marker = "__DELETED__"
-        await client.set(key, delete_marker)
-        deleted_values = [await s.get(key) for s in servers]
-        delete_score = sum(1 for v in deleted_values if v == delete_marker) / len(servers)
-        delete_scores.append(delete_score)
+    NUM_OPS = 500
+    SAMPLE_EVERY = 5  # every op is written, every 5th key is scored
+    # Pre-encoded so digest() and the RPC layer never re-encode them
+    keys = [f"conskey{i}".encode() for i in range(NUM_OPS)]
+    values = [f"consval{i}".encode() for i in range(NUM_OPS)]
+    updated_values = [f"consval{i}_updated".encode() for i in range(NUM_OPS)]
+    delete_marker = b"__DELETED__"
+    # Every key is independent, so each phase runs its operations
+    # concurrently. Each get and each set takes a slot until it returns, so
+    # the 50-way read fan-out counts against MAX_IN_FLIGHT. A set returns on
+    # its first store ack, so its remaining store RPCs to the other k-1
+    # nodes are not covered by the bound
+    sem = asyncio.Semaphore(MAX_IN_FLIGHT)
+
+    async def bounded_set(key, value):
+        async with sem:
+            await client.set(key, value)
+
+    async def bounded_get(server, key):
+        async with sem:
+            return await server.get(key)
+
+    async def set_phase(expected):
+        await asyncio.gather(*(bounded_set(k, v) for k, v in zip(keys, expected)))
+
+    async def score_phase(expected):
+        async def one(key, value):
+            got = await asyncio.gather(*(bounded_get(s, key) for s in servers))
+            return got.count(value) / len(servers)
+        sampled = zip(keys[::SAMPLE_EVERY], expected[::SAMPLE_EVERY])
+        return list(await asyncio.gather(*(one(k, v) for k, v in sampled)))
+
+    # SET
+    await set_phase(values)
+    set_scores = await score_phase(values)
+    # UPDATE
+    await set_phase(updated_values)
+    update_scores = await score_phase(updated_values)
+    # DELETE (simulate by setting value to a special marker)
+    deleted_values = [delete_marker] * NUM_OPS
+    await set_phase(deleted_values)
+    delete_scores = await score_phase(deleted_values)
     for s in servers:
         s.stop()
-    plt.figure(figsize=(10, 6))
-    plt.boxplot([set_scores, update_scores, delete_scores],
-                labels=["Set", "Update", "Delete"],
-                patch_artist=True,
-                boxprops=dict(facecolor='skyblue', color='royalblue'),
-                medianprops=dict(color='crimson', linewidth=2),
-                whiskerprops=dict(color='gray'),
-                capprops=dict(color='gray'),
-                flierprops=dict(markerfacecolor='orange', marker='o', markersize=5, alpha=0.5))
-    plt.title(f"Kademlia Consistency Score Distribution\nNodes: {NUM_NODES}, Operations: {len(set_scores)}")
-    plt.ylabel("Consistency Score (fraction of nodes correct)")
-    plt.xlabel("Operation Type")
-    plt.text(2.8, 1.02, f"Nodes: {NUM_NODES}\nOps: {len(set_scores)}", 
-             ha='right', va='top', transform=plt.gca().transAxes, 
-             bbox=dict(facecolor='white', alpha=0.7, edgecolor='gray'))
-    plt.ylim(0, 1.05)
-    plt.savefig("new_test_plots/consistency_scores.png")
+    with open("consistency_scores.json", "w") as f:
+        json.dump({"set": set_scores, "update": update_scores,
+                   "delete": delete_scores}, f)
+    print("Results written to consistency_scores.json.")
+    if not plot:
+        return
+    plt = load_pyplot()
+    fig, ax = plt.subplots(figsize=(10, 6))
+    ax.boxplot([set_scores, update_scores, delete_scores],
+               labels=["Set", "Update", "Delete"],
+               patch_artist=True,
+               boxprops=dict(facecolor='skyblue', color='royalblue'),
+               medianprops=dict(color='crimson', linewidth=2),
+               whiskerprops=dict(color='gray'),
+               capprops=dict(color='gray'),
+               flierprops=dict(markerfacecolor='orange', marker='o', markersize=5, alpha=0.5))
+    ax.set_title(f"Kademlia Consistency Score Distribution\nNodes: {NUM_NODES}, Operations: {NUM_OPS}, Samples: {len(set_scores)}")
+    ax.set_ylabel("Consistency Score (fraction of nodes correct)")
+    ax.set_xlabel("Operation Type")
+    ax.text(2.8, 1.02, f"Nodes: {NUM_NODES}\nOps: {NUM_OPS}", 
+            ha='right', va='top', transform=ax.transAxes, 
+            bbox=dict(facecolor='white', alpha=0.7, edgecolor='gray'))
+    ax.set_ylim(0, 1.05)
+    fig.savefig("new_test_plots/consistency_scores.png")
+    plt.close(fig)
     print("Consistency test complete. Plot saved as consistency_scores.png.")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run(main)
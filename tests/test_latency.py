@@ -1,30 +1,48 @@
 import asyncio
+import json
 import random
 import time
-import matplotlib.pyplot as plt
+from collections import deque
+import numpy as np
 from network import Server
+from plotting import load_pyplot, run
 
-async def main():
+async def main(plot=False):
     NUM_NODES = 20
     BASE_PORT = 9000
-    servers = []
-    for i in range(NUM_NODES):
-        s = Server()
-        await s.listen(BASE_PORT + i)
-        servers.append(s)
-    for i in range(1, NUM_NODES):
-        await servers[i].bootstrap([("127.0.0.1", BASE_PORT)])
+    servers = [Server() for _ in range(NUM_NODES)]
+    await asyncio.gather(*(s.listen(BASE_PORT + i) for i, s in enumerate(servers)))
+    await asyncio.gather(*(s.bootstrap([("127.0.0.1", BASE_PORT)])
+                           for s in servers[1:]))
     client = servers[0]
-    latencies = []
-    for i in range(500):
-        key = f"key{i}"
-        value = f"val{i}"
-        start = time.perf_counter()
+    NUM_OPS = 500
+    WINDOW = 4  # set+get pairs kept in flight
+    latencies = np.empty(NUM_OPS, dtype=np.float64)
+
+    async def timed_set_get(key, value):
+        start_ns = time.perf_counter_ns()
         await client.set(key, value)
         await client.get(key)
-        latencies.append(time.perf_counter() - start)
+        return time.perf_counter_ns() - start_ns
+
+    in_flight = deque()
+    done = 0
+    for i in range(NUM_OPS):
+        if len(in_flight) == WINDOW:
+            latencies[done] = await in_flight.popleft() * 1e-9
+            done += 1
+        in_flight.append(asyncio.ensure_future(timed_set_get(f"key{i}", f"val{i}")))
+    while in_flight:
+        latencies[done] = await in_flight.popleft() * 1e-9
+        done += 1
     for s in servers:
         s.stop()
+    with open("latencies.json", "w") as f:
+        json.dump({"latencies": latencies.tolist()}, f)
+    print("Results written to latencies.json.")
+    if not plot:
+        return
+    plt = load_pyplot()
     plt.hist(latencies, bins=20)
     plt.title(f"Kademlia Set+Get Latency Distribution\nNodes: {NUM_NODES}, Operations: {len(latencies)}")
     plt.xlabel("Latency (seconds)")
@@ -37,4 +55,4 @@ async def main():
     print("Test complete. Plot saved as simple_latency_plot.png.")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run(main)